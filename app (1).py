@@ -1,7 +1,69 @@
+import functools
+import os
 import streamlit as st
+import numpy as np
 import pandas as pd
 import re
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
+from itertools import chain
+
+# fallback-parser inputs at least this large are fanned out across cores
+_PARALLEL_MIN_ROWS = 50_000
+
+# Excel writer availability, checked once at import instead of per click
+try:
+    import xlsxwriter  # noqa: F401
+    _HAS_XLSXWRITER = True
+except ImportError:
+    _HAS_XLSXWRITER = False
+try:
+    import openpyxl  # noqa: F401
+    _HAS_OPENPYXL = True
+except ImportError:
+    _HAS_OPENPYXL = False
+
+try:
+    import numexpr  # noqa: F401
+    # route frame arithmetic (and any future derived columns via df.eval)
+    # through numexpr's fused, multi-threaded evaluator
+    pd.set_option("compute.use_numexpr", True)
+except ImportError:
+    pass
+
+try:
+    import re2 as _re2  # Google re2: linear-time matching, no backtracking
+except ImportError:
+    _re2 = None
+
+def _compile(pattern, flags=0):
+    """
+    Compile for the per-row parser, preferring re2's linear-time engine.
+    re2 takes inline flags only, so IGNORECASE is folded into the pattern;
+    anything re2 can't compile falls back to the stdlib engine.
+    """
+    if _re2 is not None:
+        try:
+            return _re2.compile(("(?i)" if flags & re.I else "") + pattern)
+        except Exception:
+            pass
+    return re.compile(pattern, flags)
+
+# ---------- Compiled patterns (compiled once, reused per row) ----------
+# leading quantity like '2x', '2×', '2 x'
+_QTY_X = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*[x×]\s*(.+)$', re.I)
+# leading plain number then space: '2 THCA Pack'
+_QTY_NUM = re.compile(r'^\s*(\d+(?:\.\d+)?)\s+(.+)$')
+# primary split on comma or semicolon
+_SPLIT = re.compile(r'\s*[;,]\s*')
+# fused item matcher: optional leading qty ('2x' / '2 x' / '2 ') then SKU text
+# up to the next comma/semicolon — one scan instead of split + per-piece match
+# (only pattern used from Python-side loops, so it can run on re2; the ones
+# above are handed to pandas .str methods, which require stdlib re.Pattern)
+_ITEM = _compile(r'\s*(?:(\d+(?:\.\d+)?)(?:\s*[x×]\s*|\s+))?([^,;]+?)\s*(?:[,;]|$)', re.I)
+# cells that need the full item matcher: a delimiter, an x/× marker anywhere,
+# or a leading number; everything else is a plain single SKU
+_NEEDS_PARSE = _compile(r'^\s*\d|[x×,;]', re.I)
 
 # ---------- Page ----------
 st.set_page_config(page_title="SKU Splitter — Robust (Safer)", layout="wide")
@@ -20,100 +82,218 @@ if use_server_file:
 preview_rows = st.number_input("Preview rows to show:", min_value=5, max_value=1000, value=10)
 
 # ---------- Helpers ----------
-def try_read_file_obj(file_obj, is_server_path=False):
+def _read_csv(src, usecols=None, nrows=None):
+    if nrows is None:
+        # PyArrow's multi-threaded reader + Arrow strings; falls back to the
+        # C engine if pyarrow is missing (nrows isn't supported by pyarrow)
+        try:
+            return pd.read_csv(src, engine="pyarrow", dtype_backend="pyarrow",
+                               encoding="utf-8", usecols=usecols)
+        except Exception:
+            # pyarrow missing, or a ragged file the C engine tolerates
+            if hasattr(src, "seek"):
+                src.seek(0)
+    return pd.read_csv(src, encoding="utf-8", low_memory=False,
+                       usecols=usecols, nrows=nrows)
+
+@st.cache_data(show_spinner=False)
+def _read_table(data, name, usecols=None, nrows=None):
+    """Cached read keyed on file content (bytes) or path, plus read params."""
+    if isinstance(data, (bytes, bytearray)):
+        src = BytesIO(data)
+    else:
+        src = data
+    if name.lower().endswith(".csv"):
+        return _read_csv(src, usecols=usecols, nrows=nrows)
+    return pd.read_excel(src, usecols=usecols, nrows=nrows)
+
+def try_read_file_obj(file_obj, is_server_path=False, usecols=None, nrows=None):
+    """
+    Read a CSV/XLSX source. `usecols` prunes to just the columns needed
+    (skips parsing and allocating the rest); `nrows` limits rows for cheap
+    header/preview reads. Results are cached across Streamlit reruns, so
+    widget interactions don't re-parse the file.
+    """
+    usecols = tuple(usecols) if usecols is not None else None
     try:
         if is_server_path:
-            path = file_obj
-            if path.lower().endswith(".csv"):
-                return pd.read_csv(path, encoding="utf-8", low_memory=False)
-            return pd.read_excel(path)
-        else:
-            name = file_obj.name.lower()
-            if name.endswith(".csv"):
-                return pd.read_csv(file_obj, encoding="utf-8", low_memory=False)
-            return pd.read_excel(file_obj)
+            return _read_table(file_obj, file_obj, usecols=usecols, nrows=nrows)
+        return _read_table(file_obj.getvalue(), file_obj.name, usecols=usecols, nrows=nrows)
     except Exception as e:
         st.error(f"Failed to read file: {e}")
         return None
 
-def parse_piece(piece_text):
+@functools.lru_cache(maxsize=100_000)
+def _parse_cell_cached(cell_text):
     """
-    Parse a single comma/semicolon-separated piece.
-    Accept leading qty markers like '2x', '2×', '2 x', or leading number '2 '.
-    If none found, assume qty=1 and return whole piece as SKU.
+    Parse comma/semicolon-separated items in a single regex sweep.
+    Each item may carry a leading qty marker like '2x', '2×', '2 x', or a
+    leading number '2 '; otherwise qty defaults to 1.
+    Memoized: order reports repeat the same SKU-combo strings many times,
+    so duplicate cells cost one dict lookup instead of a re-parse.
+    Returns a tuple of (qty, sku) tuples so results are safely shareable.
     """
-    if not isinstance(piece_text, str):
-        piece_text = str(piece_text)
-    p = piece_text.strip().rstrip(",;")
-    if p == "" or p.lower() in ("nan","none"):
-        return []
-    # leading quantity like '2x', '2×', '2 x'
-    m = re.match(r'^\s*(\d+(?:\.\d+)?)\s*[x×]\s*(.+)$', p, flags=re.I)
-    if m:
-        qty = float(m.group(1))
-        sku = m.group(2).strip()
-        return [(qty, sku)]
-    # leading plain number then space: '2 THCA Pack'
-    m2 = re.match(r'^\s*(\d+(?:\.\d+)?)\s+(.+)$', p)
-    if m2:
-        qty = float(m2.group(1)); sku = m2.group(2).strip()
-        return [(qty, sku)]
-    # no leading qty -> qty 1
-    return [(1.0, p)]
-
-def parse_cell_safe(cell_text):
-    """Split on commas/semicolons first, then parse each piece for leading qty."""
-    if not isinstance(cell_text, str):
-        cell_text = str(cell_text)
     text = cell_text.strip()
     if text == "" or text.lower() in ("nan","none"):
-        return []
-    # Primary split on comma or semicolon
-    pieces = re.split(r'\s*[;,]\s*', text)
+        return ()
+    # fast path: no delimiter, no qty marker, no leading number — the common
+    # plain single-SKU cell skips the item matcher entirely
+    if _NEEDS_PARSE.search(text) is None:
+        return ((1.0, text),)
     out = []
-    for piece in pieces:
-        piece = piece.strip()
-        if not piece:
+    for m in _ITEM.finditer(text):
+        sku = m.group(2).strip()
+        if not sku or sku.lower() in ("nan","none"):
             continue
-        parsed = parse_piece(piece)
-        for qty, sku in parsed:
-            out.append((qty, sku))
+        qty = float(m.group(1)) if m.group(1) else 1.0
+        out.append((qty, sku))
     if out:
-        return out
+        return tuple(out)
     # Fallback: whole cell as single SKU qty=1
-    return [(1.0, text)]
+    return ((1.0, text),)
+
+def _split_skus_vectorized(df, sku_col, order_col=None):
+    """
+    Vectorized version of the comma-first parser: one C-level split/explode/extract
+    sweep over the whole column instead of a Python loop with re calls per row.
+    Semantics match the per-row parser (split on , or ; first, then leading qty).
+    """
+    s = _as_string(df[sku_col]).str.strip()
+    valid = s.notna() & s.ne("") & ~s.str.lower().isin(["nan", "none"])
+    s = s[valid]
+    pieces = s.str.split(_SPLIT, regex=True).explode().str.strip()
+    pieces = pieces[pieces.notna() & pieces.ne("") & ~pieces.str.lower().isin(["nan", "none"])]
+    qty_x = pieces.str.extract(_QTY_X)
+    qty_num = pieces.str.extract(_QTY_NUM)
+    qty = pd.to_numeric(qty_x[0].fillna(qty_num[0]), errors="coerce",
+                        downcast="float").fillna(1.0)
+    sku = qty_x[1].fillna(qty_num[1]).fillna(pieces).str.strip().str.rstrip(",;")
+    out = pd.DataFrame({"SKU": sku.astype(object), "Qty": qty})
+    # cells that were all delimiters/empty pieces fall back to the whole cell, qty 1
+    missing = s.index.difference(pieces.index.unique())
+    if len(missing):
+        # np.float32 so the concat below doesn't upcast Qty back to float64
+        fallback = pd.DataFrame({"SKU": s.loc[missing].astype(object), "Qty": np.float32(1.0)})
+        out = pd.concat([out, fallback]).sort_index(kind="stable")
+    if order_col:
+        out.insert(0, "Order ID", df[order_col].reindex(out.index))
+    return out.reset_index(drop=True)
+
+def _as_string(series):
+    """
+    Cast to Arrow-backed string dtype when pyarrow is available: one
+    contiguous buffer plus offsets instead of per-cell PyObjects, and .str
+    ops dispatch to Arrow's C++ kernels. Falls back to NumPy-backed strings.
+    """
+    try:
+        return series.astype("string[pyarrow]")
+    except (ImportError, TypeError):
+        return series.astype("string")
+
+def _parse_chunk(values):
+    """Worker: parse a chunk of cell strings into flat (skus, qtys, counts)."""
+    parsed = [_parse_cell_cached(v if isinstance(v, str) else str(v)) for v in values]
+    counts = [len(p) for p in parsed]
+    items = list(chain.from_iterable(parsed))
+    if not items:
+        return [], [], counts
+    qtys, skus = zip(*items)
+    return list(skus), list(qtys), counts
+
+def _build_output(skus, qtys, counts, sub, order_col):
+    """Assemble the result frame once from flat parser output."""
+    if not skus:
+        return pd.DataFrame(columns=["Order ID","SKU","Qty"])
+    data = {"SKU": skus, "Qty": pd.to_numeric(qtys, downcast="float", errors="coerce")}
+    if order_col:
+        data = {"Order ID": np.repeat(sub[order_col].to_numpy(), counts), **data}
+    return _as_category(pd.DataFrame(data))
+
+def _split_parallel(sub, sku_col, order_col):
+    """
+    Row parsing is CPU-bound and embarrassingly parallel: chunk the column,
+    map _parse_chunk across a process pool, and rebuild the columns once.
+    Returns None if the pool can't be used so the serial loop takes over.
+    """
+    try:
+        chunks = np.array_split(sub[sku_col].to_numpy(), os.cpu_count())
+        with ProcessPoolExecutor() as ex:
+            results = list(ex.map(_parse_chunk, chunks))
+    except Exception:
+        return None
+    skus, qtys, counts = [], [], []
+    for s_, q_, c_ in results:
+        skus.extend(s_)
+        qtys.extend(q_)
+        counts.extend(c_)
+    return _build_output(skus, qtys, counts, sub, order_col)
+
+def _as_category(out):
+    """Store repeated SKU / Order ID strings once, with integer codes per row."""
+    for col in ("SKU", "Order ID"):
+        if col in out.columns:
+            out[col] = out[col].astype("category")
+    return out
 
 def split_skus(df, sku_col, order_col=None):
-    rows = []
-    for _, r in df.iterrows():
-        text = r.get(sku_col, "")
-        parsed = parse_cell_safe(text)
-        if not parsed:
-            continue
-        for qty, sku in parsed:
-            row = {"SKU": sku, "Qty": qty}
-            if order_col and order_col in df.columns:
-                row["Order ID"] = r.get(order_col)
-            rows.append(row)
-    if rows:
-        out = pd.DataFrame(rows)
-        cols = ["Order ID", "SKU", "Qty"]
-        return out[[c for c in cols if c in out.columns]]
-    return pd.DataFrame(columns=["Order ID","SKU","Qty"])
+    # validate the optional order column once up front; both paths below can
+    # then treat a truthy order_col as known-present
+    if order_col and order_col not in df.columns:
+        order_col = None
+    try:
+        out = _split_skus_vectorized(df, sku_col, order_col)
+        if not out.empty:
+            return _as_category(out)
+    except Exception:
+        pass  # odd dtypes etc. — fall back to the per-row parser below
+    # drop empty/NaN/'nan'/'none' cells in one vectorized mask so the parser
+    # only ever sees rows that will produce output
+    stripped = _as_string(df[sku_col]).str.strip()
+    valid = stripped.notna() & stripped.ne("") & ~stripped.str.lower().isin(["nan", "none"])
+    sub = df.loc[valid]
+    _parse_cell_cached.cache_clear()  # fresh cache per transform run
+    if len(sub) >= _PARALLEL_MIN_ROWS and (os.cpu_count() or 1) > 1:
+        parallel = _split_parallel(sub, sku_col, order_col)
+        if parallel is not None:
+            return parallel
+    skus, qtys, counts = _parse_chunk(sub[sku_col].to_numpy())
+    return _build_output(skus, qtys, counts, sub, order_col)
+
+def _csv_bytes(out):
+    """Serialize via Arrow's multi-threaded CSV writer; falls back to to_csv."""
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pacsv
+        buf = BytesIO()
+        pacsv.write_csv(pa.Table.from_pandas(out, preserve_index=False), buf)
+        return buf.getvalue()
+    except Exception:
+        return out.to_csv(index=False).encode("utf-8")
+
+@st.cache_data(show_spinner=False)
+def _split_skus_cached(df, sku_col, order_col):
+    """Cached transform: reruns with the same frame and columns are free."""
+    return split_skus(df, sku_col, order_col)
 
 # ---------- Main UI logic ----------
-df = None
+source = None
+is_server = False
 if use_server_file:
-    df = try_read_file_obj(SERVER_TEST_PATH, is_server_path=True)
+    source, is_server = SERVER_TEST_PATH, True
 elif uploaded:
-    df = try_read_file_obj(uploaded, is_server_path=False)
+    source = uploaded
+
+# header-only read: enough for the column pickers without parsing the body
+header_df = try_read_file_obj(source, is_server_path=is_server, nrows=0) if source is not None else None
 
-if df is not None:
+if header_df is not None:
     st.subheader("Source preview")
-    st.dataframe(df.head())
+    preview_df = try_read_file_obj(source, is_server_path=is_server, nrows=5)
+    if preview_df is not None:
+        st.dataframe(preview_df)
 
     # Column selection via dropdown (avoid casing/spacing typos)
-    col_list = list(df.columns)
+    col_list = list(header_df.columns)
     default_sku = next((c for c in col_list if c.strip().lower() == "sku sold"), col_list[0])
     sku_col = st.selectbox("Select SKU column (exact):", options=col_list, index=col_list.index(default_sku))
     # optional order id
@@ -126,7 +306,12 @@ if df is not None:
         order_col_choice = st.selectbox("Select Order ID column (optional):", options=[None] + col_list, index=0)
 
     if st.button("Transform / Split SKUs"):
-        out = split_skus(df, sku_col, order_col_choice if order_col_choice else None)
+        # full read happens only now, pruned to the columns actually used
+        wanted = [sku_col] + ([order_col_choice] if order_col_choice and order_col_choice != sku_col else [])
+        df = try_read_file_obj(source, is_server_path=is_server, usecols=wanted)
+        if df is None:
+            st.stop()
+        out = _split_skus_cached(df, sku_col, order_col_choice if order_col_choice else None)
         if out.empty:
             st.warning("Transformation produced no rows. Showing debug SKU samples (first 50) to help tune parser.")
             st.subheader("Raw SKU samples (first 50)")
@@ -137,18 +322,24 @@ if df is not None:
             st.dataframe(out.head(preview_rows))
 
             # CSV download (always available)
-            st.download_button("Download CSV", out.to_csv(index=False).encode("utf-8"),
+            st.download_button("Download CSV", _csv_bytes(out),
                                "SKU_Split.csv", "text/csv")
 
-            # Excel download: attempt only if openpyxl exists
-            try:
-                import openpyxl  # noqa: F401
+            # Excel download: prefer xlsxwriter, which serializes faster and
+            # lighter than openpyxl. (constant_memory mode is off: it flushes
+            # rows eagerly, but to_excel writes column-by-column, so flushed
+            # rows would lose every column after the first.)
+            if _HAS_XLSXWRITER or _HAS_OPENPYXL:
                 excel_buffer = BytesIO()
-                with pd.ExcelWriter(excel_buffer, engine="openpyxl") as writer:
-                    out.to_excel(writer, index=False, sheet_name="SKU_Split")
+                if _HAS_XLSXWRITER:
+                    with pd.ExcelWriter(excel_buffer, engine="xlsxwriter") as writer:
+                        out.to_excel(writer, index=False, sheet_name="SKU_Split")
+                else:
+                    with pd.ExcelWriter(excel_buffer, engine="openpyxl") as writer:
+                        out.to_excel(writer, index=False, sheet_name="SKU_Split")
                 st.download_button("Download Excel", excel_buffer.getvalue(), "SKU_Split.xlsx",
                                    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-            except Exception:
-                st.info("Excel download skipped because 'openpyxl' is not installed. Add 'openpyxl' to requirements.txt to enable .xlsx downloads.")
+            else:
+                st.info("Excel download skipped because neither 'xlsxwriter' nor 'openpyxl' is installed. Add one to requirements.txt to enable .xlsx downloads.")
 else:
     st.info("Upload a CSV/XLSX file or enable 'Use server test file' to begin.")